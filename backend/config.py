@@ -4,6 +4,8 @@ Centralized settings for all components
 """
 
 import os
+import shutil
+import sys
 from pathlib import Path
 
 # ============================================================================
@@ -19,12 +21,30 @@ FRONTEND_DIR = BASE_DIR / "frontend"
 # Data directory
 DATA_DIR = BASE_DIR / "data"
 
-# HLS output directory (where video segments are stored)
-HLS_DIR = DATA_DIR / "hls"
+# HLS output directory (where video segments are stored).
+# On Linux prefer tmpfs (/dev/shm): segments are written once and read back
+# on every client request, so keeping them in RAM removes disk I/O from the
+# hot path. Override with PREVIEWLY_HLS_DIR; falls back to the data dir when
+# tmpfs is unavailable or too small.
+_MIN_HLS_FREE_BYTES = 512 * 1024 * 1024
+
+_hls_override = os.environ.get("PREVIEWLY_HLS_DIR")
+if _hls_override:
+    HLS_DIR = Path(_hls_override)
+elif sys.platform == "linux" and Path("/dev/shm").is_dir():
+    HLS_DIR = Path("/dev/shm/previewly/hls")
+else:
+    HLS_DIR = DATA_DIR / "hls"
 
 # Create directories if they don't exist
 HLS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Not enough room on the fast location - fall back to disk
+if HLS_DIR != DATA_DIR / "hls" and shutil.disk_usage(HLS_DIR).free < _MIN_HLS_FREE_BYTES:
+    print(f"⚠️  {HLS_DIR} has less than {_MIN_HLS_FREE_BYTES // (1024*1024)}MB free - using disk instead")
+    HLS_DIR = DATA_DIR / "hls"
+    HLS_DIR.mkdir(parents=True, exist_ok=True)
+
 
 # ============================================================================
 # SERVER SETTINGS
@@ -47,12 +67,41 @@ CORS_ORIGINS = [
 # HLS segment duration (seconds)
 SEGMENT_DURATION = 30
 
+# Segment duration used for preview HLS output (seconds)
+PREVIEW_SEGMENT_SECONDS = 10
+
+# Duration of the first segments (seconds). Playback can start as soon as
+# one segment exists, so a short initial segment cuts time-to-first-frame
+# without paying the per-segment overhead for the whole stream.
+HLS_INIT_SECONDS = 2
+
 # Video codec
 VIDEO_CODEC = "libx264"
 
 # Audio codec
 AUDIO_CODEC = "aac"
 
+# Encoder tuning (only used when stream copy is not possible and we re-encode)
+VIDEO_PRESET = "ultrafast"
+VIDEO_TUNE = "zerolatency"
+
+# Assumed frame rate for GOP alignment
+VIDEO_FPS = 30
+
+# Keyframe interval aligned to segment boundaries, so every HLS segment
+# starts on an I-frame and the encoder never splits a GOP across segments
+GOP_SIZE = VIDEO_FPS * PREVIEW_SEGMENT_SECONDS
+
+# Multi-rendition output (master playlist + quality variants). Off by
+# default so the single stream-copy fast path is not regressed.
+MULTI_RENDITION = False
+
+# Quality variants: (name, scale filter size, video bitrate)
+RENDITIONS = [
+    ("720p", "1280:720", "2800k"),
+    ("480p", "854:480", "1400k"),
+]
+
 # FFmpeg timeout (seconds to wait for video processing)
 FFMPEG_TIMEOUT = 120  # 2 minutes
 
@@ -83,14 +132,26 @@ TOTAL_ACTIVE_SEGMENTS = BACKWARD_BUFFER_SEGMENTS + 1 + FORWARD_BUFFER_SEGMENTS
 # Session timeout (seconds)
 SESSION_TIMEOUT = 3600  # 1 hour
 
+# Hard cap on simultaneously active preview sessions
+MAX_CONCURRENT_SESSIONS = 100
+
 
 # ============================================================================
 # VALIDATION
 # ============================================================================
 
-# Validate paths
-assert FRONTEND_DIR.exists(), f"Frontend directory not found: {FRONTEND_DIR}"
-assert HLS_DIR.exists(), f"HLS directory not found: {HLS_DIR}"
+def validate():
+    """
+    Check configured paths once at server startup.
+
+    Kept out of module import so spawned workers and tooling don't re-stat
+    the tree just for importing config, and uses explicit raises instead of
+    asserts, which silently vanish under python -O.
+    """
+    if not FRONTEND_DIR.exists():
+        raise RuntimeError(f"Frontend directory not found: {FRONTEND_DIR}")
+    if not HLS_DIR.exists():
+        raise RuntimeError(f"HLS directory not found: {HLS_DIR}")
 
 
 # ============================================================================
@@ -1,25 +1,66 @@
 """
 Main FastAPI Server for Previewly Video Preview System
-DOWNLOAD-FIRST APPROACH - Most reliable method
-Downloads video, then converts locally
+STREAMING PIPELINE - download is piped straight into FFmpeg
+(a local copy is kept for probing and re-encode fallback)
 """
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
+import asyncio
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import hashlib
+import re
+import shutil
+import signal
+import sys
 import uuid
 import subprocess
 import time
-import glob
-import threading
-import requests
+import aiofiles
+import httpx
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Dict, Optional
 
+from watchfiles import Change, awatch
+
+logger = logging.getLogger("previewly")
+
+# Listener draining the log queue on its own thread (started at startup)
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging():
+    """
+    Route app logging through a queue.
+
+    Handlers that write to stdout block the event loop while the pipe to the
+    log collector is busy; a QueueHandler makes emission a lock-free enqueue
+    and a QueueListener thread does the actual writing off-loop.
+    """
+    global log_listener
+
+    log_queue = queue.Queue(-1)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+
+    log_listener = logging.handlers.QueueListener(log_queue, handler)
+    log_listener.start()
+
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
 # Import our configuration
 from config import (
     FRONTEND_DIR,
@@ -28,12 +69,22 @@ from config import (
     SERVER_PORT,
     CORS_ORIGINS,
     SEGMENT_DURATION,
+    PREVIEW_SEGMENT_SECONDS,
+    HLS_INIT_SECONDS,
     VIDEO_CODEC,
     AUDIO_CODEC,
+    VIDEO_PRESET,
+    VIDEO_TUNE,
+    GOP_SIZE,
+    TOTAL_ACTIVE_SEGMENTS,
+    MULTI_RENDITION,
+    RENDITIONS,
     FFMPEG_TIMEOUT,
     MIN_SEGMENTS_TO_START,
     SESSION_TIMEOUT,
-    print_config
+    MAX_CONCURRENT_SESSIONS,
+    print_config,
+    validate as validate_config
 )
 
 
@@ -41,10 +92,24 @@ from config import (
 # INITIALIZE FASTAPI APP
 # ============================================================================
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Lifespan wrapper - the actual startup/shutdown logic lives with the
+    rest of the lifecycle code at the bottom of this module.
+    """
+    await server_startup()
+    try:
+        yield
+    finally:
+        await server_shutdown()
+
+
 app = FastAPI(
     title="Previewly API",
     description="Backend-controlled video preview system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
@@ -61,12 +126,143 @@ app.add_middleware(
 )
 
 
+# ============================================================================
+# ROUTES - HLS PLAYLIST (cached)
+# ============================================================================
+
+# Playlist bytes cache: preview_id -> (mtime, cached_at, body)
+playlist_cache: Dict[str, tuple] = {}
+
+# How long a cached playlist may be served without even re-checking mtime
+PLAYLIST_CACHE_TTL = 0.5
+
+# Download read size: ~256 KB is the measured sweet spot for streamed HTTP
+# reads - past that, larger chunks only add buffer-copy cost
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+
+# Chunks buffered between the network reader and the disk/stdin writer
+# (16 x 256 KB = 4 MB of read-ahead per session)
+READAHEAD_CHUNKS = 16
+
+
+# NOTE: registered before the /hls StaticFiles mount below so it wins routing
+@app.get("/hls/{preview_id}/playlist.m3u8")
+async def serve_playlist(preview_id: str, request: Request):
+    """
+    Serve playlist.m3u8 from an in-memory cache.
+
+    HLS clients refetch the playlist every few seconds even though its bytes
+    only change when FFmpeg writes a segment; a short TTL plus an mtime guard
+    collapses those refetches into one stat+read per playlist write, and an
+    mtime-derived ETag turns unchanged refetches into bodyless 304s.
+    """
+    inm = request.headers.get("if-none-match")
+    playlist_path = HLS_DIR / preview_id / "playlist.m3u8"
+    now = time.monotonic()
+
+    cached = playlist_cache.get(preview_id)
+    if cached is not None:
+        mtime, cached_at, body = cached
+
+        if now - cached_at < PLAYLIST_CACHE_TTL:
+            return playlist_response(body, mtime, inm)
+
+        try:
+            st = os.stat(playlist_path)
+        except FileNotFoundError:
+            playlist_cache.pop(preview_id, None)
+            raise HTTPException(status_code=404, detail="Playlist not found")
+
+        if st.st_mtime == mtime:
+            playlist_cache[preview_id] = (mtime, now, body)
+            return playlist_response(body, mtime, inm)
+
+    try:
+        st = os.stat(playlist_path)
+        body = playlist_path.read_bytes()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+
+    playlist_cache[preview_id] = (st.st_mtime, now, body)
+    return playlist_response(body, st.st_mtime, inm)
+
+
+# Valid segment file names (rejects traversal and junk requests up-front)
+SEGMENT_NAME_RE = re.compile(r"^segment\d+$")
+
+
+@app.get("/hls/{preview_id}/{segment_name}.ts")
+async def serve_segment(preview_id: str, segment_name: str, request: Request):
+    """
+    Serve a .ts segment via sendfile with immutable caching.
+
+    Segment bytes never change once written, so clients and CDNs may cache
+    them forever. Passing the precomputed stat to FileResponse lets Starlette
+    hand the file-to-socket copy to sendfile(2) instead of a Python read loop.
+    Conditional requests get a bodyless 304 from the mtime-based ETag.
+    """
+    if not SEGMENT_NAME_RE.match(segment_name):
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    segment_path = HLS_DIR / preview_id / f"{segment_name}.ts"
+
+    try:
+        stat_result = os.stat(segment_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return FileResponse(
+        segment_path,
+        media_type="video/mp2t",
+        headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": etag
+        },
+        stat_result=stat_result
+    )
+
+
+def playlist_response(body: bytes, mtime: float, if_none_match) -> Response:
+    """Build the m3u8 response (or a 304) with revalidate caching"""
+    etag = f'"{int(mtime * 1000):x}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=body,
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "max-age=0, must-revalidate", "ETag": etag}
+    )
+
+
 # ============================================================================
 # STATIC FILE SERVING
 # ============================================================================
 
+class HLSStaticFiles(StaticFiles):
+    """
+    StaticFiles with HLS-appropriate cache headers.
+
+    Covers files the dedicated routes above don't (master/rendition
+    playlists): .ts bytes never change once written so clients may cache
+    them forever; playlists grow, so they get a short max-age instead.
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        path = getattr(response, "path", "")
+        if str(path).endswith(".ts"):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        elif str(path).endswith(".m3u8"):
+            response.headers["Cache-Control"] = "max-age=2"
+        return response
+
+
 app.mount("/static", StaticFiles(directory=str(FRONTEND_DIR)), name="static")
-app.mount("/hls", StaticFiles(directory=str(HLS_DIR)), name="hls")
+app.mount("/hls", HLSStaticFiles(directory=str(HLS_DIR)), name="hls")
 
 
 # ============================================================================
@@ -75,17 +271,82 @@ app.mount("/hls", StaticFiles(directory=str(HLS_DIR)), name="hls")
 
 active_sessions: Dict[str, dict] = {}
 
+# Per-preview stop events so end_preview can cancel an in-flight segment watch
+watch_stop_events: Dict[str, asyncio.Event] = {}
+
+# Live background tasks (watchers, pumps, drains). Holding a reference
+# stops the loop from garbage-collecting running tasks, and shutdown can
+# cancel whatever is still pending instead of leaving tasks to die with
+# "Task was destroyed but it is pending" warnings.
+background_tasks: set = set()
+
+
+def spawn_task(coro) -> asyncio.Task:
+    """Create a tracked background task that unregisters itself when done"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Most recent FFmpeg stderr lines per preview (ring buffer for debugging)
+ffmpeg_logs: Dict[str, deque] = {}
+
+# Bounds simultaneously active previews; acquired per new session in
+# start_preview and released when the session is cleaned up. Semaphore
+# waiters are served FIFO, so requests arriving while the server is at
+# capacity form an ordered admission queue rather than thundering in.
+session_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SESSIONS)
+
+# How long a start request may wait in the admission queue before the
+# server sheds it - a brief wait rides out bursts, shedding protects
+# latency once the backlog is real
+ADMISSION_WAIT_SECONDS = 2.0
+
+# Separate, CPU-sized cap for sessions that actually re-encode: stream
+# copies are I/O-bound and dozens can coexist, but each software encode
+# wants cores, and N simultaneous encodes on N-1 cores just thrash
+transcode_semaphore = asyncio.Semaphore(max(1, (os.cpu_count() or 2) - 1))
+
+# Deduplication: viewers of the same URL share one FFmpeg process.
+# url_to_preview maps a URL hash to the preview serving it; preview_refcounts
+# tracks how many viewers hold that preview open.
+url_to_preview: Dict[str, str] = {}
+preview_refcounts: Dict[str, int] = {}
+
+# Shared HTTP client (created at startup) - reuses TCP+TLS connections
+# across previews instead of handshaking per download
+http_client: Optional[httpx.AsyncClient] = None
+
+# Hardware H.264 encoder detected at startup (None = CPU libx264)
+HW_ENCODER: Optional[str] = None
+
+# Extra flags per hardware encoder (tuned for low-latency preview encoding).
+# h264_vaapi is deliberately absent: it can't consume software frames
+# without a -vaapi_device plus a format=nv12,hwupload filter chain, and
+# until that pipeline is wired up, offering it would fail every re-encode
+# on machines where it's detected.
+HW_ENCODER_FLAGS = {
+    "h264_nvenc": ["-preset", "p4", "-rc", "vbr", "-cq", "23"],
+    "h264_qsv": ["-preset", "veryfast", "-global_quality", "23"],
+    "h264_videotoolbox": ["-realtime", "true"]
+}
+
 
 # ============================================================================
 # ROUTES - FRONTEND
 # ============================================================================
 
 @app.get("/")
-async def serve_frontend():
-    """Serve the main frontend page"""
-    index_path = FRONTEND_DIR / "index.html"
-    
-    if not index_path.exists():
+async def serve_frontend(request: Request):
+    """
+    Serve the main frontend page from memory.
+
+    The HTML is read once at startup; requests cost zero syscalls and
+    If-None-Match hits answer with an empty 304.
+    """
+    index_bytes = getattr(app.state, "index_bytes", None)
+
+    if index_bytes is None:
         return JSONResponse(
             status_code=404,
             content={
@@ -93,19 +354,44 @@ async def serve_frontend():
                 "message": "index.html not found"
             }
         )
-    
-    return FileResponse(index_path)
+
+    if request.headers.get("if-none-match") == app.state.index_etag:
+        return Response(status_code=304)
+
+    return Response(
+        content=index_bytes,
+        media_type="text/html",
+        headers={
+            "ETag": app.state.index_etag,
+            "Cache-Control": "public, max-age=60"
+        }
+    )
 
 
 # ============================================================================
-# ROUTES - VIDEO PREVIEW (DOWNLOAD-FIRST MODE)
+# ROUTES - VIDEO PREVIEW (STREAMING PIPELINE)
 # ============================================================================
 
+def segment_preload_headers(preview_id: str) -> dict:
+    """
+    Preload hints for the first two segments.
+
+    HTTP/2-aware players can start fetching segment bytes while still
+    parsing the playlist, saving a round-trip at startup.
+    """
+    links = ", ".join(
+        f"</hls/{preview_id}/segment{i:03d}.ts>; rel=preload; as=video"
+        for i in range(2)
+    )
+    return {"Link": links}
+
+
 @app.post("/start-preview")
 async def start_preview(request: Request):
     """
-    Start video preview - DOWNLOAD FIRST APPROACH
-    Downloads video to disk, then converts locally (much faster!)
+    Start video preview - STREAMING PIPELINE
+    The download is piped into FFmpeg as it arrives; segments appear while
+    the transfer is still running.
     """
     
     # Parse request body
@@ -121,215 +407,208 @@ async def start_preview(request: Request):
     if not video_url.startswith("http"):
         raise HTTPException(status_code=400, detail="URL must start with http:// or https://")
     
+    # Reuse an existing preview of the same URL instead of double-encoding
+    # (segment_preload_headers lets the player fetch the opening segments
+    # concurrently with parsing the playlist)
+    url_key = hashlib.sha256(video_url.encode()).hexdigest()[:16]
+    existing_id = url_to_preview.get(url_key)
+    if (
+        existing_id
+        and existing_id in active_sessions
+        # Never hand out a dead session - a failed preview's directory is
+        # gone, and refreshing its TTL would keep the tombstone alive
+        and active_sessions[existing_id]["state"] != "failed"
+    ):
+        preview_refcounts[existing_id] = preview_refcounts.get(existing_id, 1) + 1
+        session = active_sessions[existing_id]
+        # A cache hit is a sign of demand - push the idle timeout out so the
+        # reaper doesn't tear down a preview that keeps getting re-requested
+        session["started"] = time.monotonic()
+        logger.info("[Preview] Reusing %s for duplicate URL (%d viewers)",
+                    existing_id, preview_refcounts[existing_id])
+        return JSONResponse(
+            status_code=202,
+            content={
+                "preview_id": existing_id,
+                "playlist_url": session["playlist_url"],
+                "segment_duration": PREVIEW_SEGMENT_SECONDS,
+                "state": session["state"],
+                "status_url": f"/status/{existing_id}",
+                "message": "Reusing existing preview for this URL"
+            },
+            headers=segment_preload_headers(existing_id)
+        )
+
+    # Fail fast on URLs that don't resolve or respond
+    try:
+        await probe_video_url(video_url)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=400, detail=f"Video URL unreachable: {str(e)}")
+
+    # Bound concurrent sessions - a runaway client must not be able to spawn
+    # unbounded FFmpeg processes. At capacity, queue briefly for a freed
+    # slot; shed the request once the wait exceeds the admission budget.
+    try:
+        await asyncio.wait_for(
+            session_semaphore.acquire(), timeout=ADMISSION_WAIT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Server at capacity - try again later"
+        )
+
     # Generate preview ID
     preview_id = f"preview_{uuid.uuid4().hex[:8]}"
-    
-    # Create directory
+
+    # Paths (the directory itself is created after the admission gates
+    # below - a request shed at the transcode gate must leave nothing in
+    # HLS_DIR behind)
     preview_dir_str = os.path.join(str(HLS_DIR), preview_id)
-    os.makedirs(preview_dir_str, exist_ok=True)
-    
-    # Paths
     playlist_path_str = os.path.join(preview_dir_str, "playlist.m3u8")
     segment_pattern = os.path.join(preview_dir_str, "segment%03d.ts")
     local_video_path = os.path.join(preview_dir_str, "input_video.mp4")
     
-    print(f"\n{'='*70}")
-    print(f"[Preview] NEW REQUEST (DOWNLOAD-FIRST MODE)")
-    print(f"{'='*70}")
-    print(f"[Preview] ID: {preview_id}")
-    print(f"[Preview] URL: {video_url}")
-    print(f"{'='*70}\n")
-    
-    # STEP 1: DOWNLOAD VIDEO FIRST
-    print(f"[Download] Starting download...")
-    print(f"[Download] Saving to: {local_video_path}\n")
+    logger.info("[Preview] New request: id=%s url=%s", preview_id, video_url)
     
-    download_start = time.time()
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-        }
-        
-        response = requests.get(
-            video_url, 
-            headers=headers, 
-            stream=True,
-            timeout=60
+    # Stream copy is 50-100x cheaper than re-encoding, but only valid when
+    # the source codecs are already HLS-compatible. Optimistically copy when
+    # the probe is inconclusive - that is the common case for MP4 URLs.
+    source_video, source_audio = await probe_codecs(video_url)
+    reencode = (
+        source_video is not None
+        and not (
+            source_video == "h264"
+            and source_audio in (None, "aac", "mp3")
         )
-        response.raise_for_status()
-        
-        # Get file size
-        total_size = int(response.headers.get('content-length', 0))
-        if total_size > 0:
-            total_mb = total_size / (1024 * 1024)
-            print(f"[Download] File size: {total_mb:.1f} MB")
-        
-        # Download in chunks
-        downloaded = 0
-        last_log = 0
-        with open(local_video_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=1024*1024):  # 1MB chunks
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    downloaded_mb = downloaded / (1024 * 1024)
-                    
-                    # Log every 10MB
-                    if downloaded_mb - last_log >= 10:
-                        if total_size > 0:
-                            pct = (downloaded / total_size) * 100
-                            print(f"[Download] {downloaded_mb:.0f}MB / {total_mb:.0f}MB ({pct:.0f}%)")
-                        else:
-                            print(f"[Download] {downloaded_mb:.0f}MB downloaded...")
-                        last_log = downloaded_mb
-        
-        download_time = int(time.time() - download_start)
-        file_size_mb = os.path.getsize(local_video_path) / (1024 * 1024)
-        print(f"\n[Download] ✅ Complete! {file_size_mb:.1f}MB in {download_time}s")
-        
-    except requests.exceptions.Timeout:
-        cleanup_preview_directory(Path(preview_dir_str))
-        raise HTTPException(status_code=500, detail="Download timeout - video URL too slow")
-    except requests.exceptions.RequestException as e:
-        cleanup_preview_directory(Path(preview_dir_str))
-        raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
-    except Exception as e:
-        cleanup_preview_directory(Path(preview_dir_str))
-        raise HTTPException(status_code=500, detail=f"Download error: {str(e)}")
-    
-    # STEP 2: RUN FFMPEG ON LOCAL FILE (much faster!)
-    print(f"\n[FFmpeg] Starting conversion on LOCAL file...")
-    print(f"[FFmpeg] Mode: STREAM COPY (no re-encoding)")
-    print(f"[FFmpeg] Input: {local_video_path}\n")
-    
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-hide_banner",
-        "-y",
-        "-i", local_video_path,   # LOCAL FILE (not URL!)
-        "-c", "copy",              # Copy streams (fast!)
-        "-f", "hls",
-        "-hls_time", "10",
-        "-hls_list_size", "0",
-        "-hls_segment_filename", segment_pattern,
-        "-start_number", "0",
-        playlist_path_str
-    ]
-    
-    # Start FFmpeg
+    )
+    if reencode:
+        logger.info("[Preview] Source codecs %s/%s need re-encoding",
+                    source_video, source_audio)
+
+    # Encodes are additionally gated on the CPU-sized transcode cap
+    transcode_slot = False
+    if reencode or MULTI_RENDITION:
+        try:
+            await asyncio.wait_for(
+                transcode_semaphore.acquire(), timeout=ADMISSION_WAIT_SECONDS
+            )
+            transcode_slot = True
+        except asyncio.TimeoutError:
+            session_semaphore.release()
+            raise HTTPException(
+                status_code=503,
+                detail="All transcode slots busy - try again later"
+            )
+
+    # Both gates passed - now it's safe to create the preview directory
+    os.makedirs(preview_dir_str, exist_ok=True)
+
+    # STEP 1: START FFMPEG READING FROM STDIN
+    # FFmpeg consumes the HTTP body as it arrives instead of waiting for a
+    # staged download, so segmentation begins at byte zero.
+    if MULTI_RENDITION:
+        # Rendition subdirectories must exist before FFmpeg writes into them
+        for i in range(len(RENDITIONS)):
+            os.makedirs(os.path.join(preview_dir_str, str(i)), exist_ok=True)
+        ffmpeg_cmd = build_multi_rendition_command("pipe:0", preview_dir_str)
+        playlist_url = f"/hls/{preview_id}/master.m3u8"
+    else:
+        ffmpeg_cmd = build_ffmpeg_command(
+            "pipe:0", playlist_path_str, segment_pattern, reencode=reencode
+        )
+        playlist_url = f"/hls/{preview_id}/playlist.m3u8"
+
     try:
-        ffmpeg_process = subprocess.Popen(
-            ffmpeg_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=str(HLS_DIR)
+        ffmpeg_process = await asyncio.create_subprocess_exec(
+            *ffmpeg_cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=str(HLS_DIR),
+            preexec_fn=ffmpeg_preexec if os.name == "posix" else None
         )
-        print(f"[FFmpeg] Process started (PID: {ffmpeg_process.pid})\n")
+        logger.info("[FFmpeg] Process started (PID: %d)", ffmpeg_process.pid)
     except Exception as e:
-        cleanup_preview_directory(Path(preview_dir_str))
+        session_semaphore.release()
+        if transcode_slot:
+            transcode_semaphore.release()
+        await asyncio.to_thread(cleanup_preview_directory, Path(preview_dir_str))
         raise HTTPException(status_code=500, detail=f"FFmpeg failed: {str(e)}")
+
+    # Drain stderr so the pipe never fills and stalls the encoder
+    spawn_task(drain_ffmpeg_stderr(preview_id, ffmpeg_process.stderr))
+
+    # STEP 2: PUMP THE DOWNLOAD INTO FFMPEG IN THE BACKGROUND
+    download_done = asyncio.Event()
+    pump_task = spawn_task(
+        pump_download(
+            preview_id, video_url, local_video_path,
+            ffmpeg_process, download_done
+        )
+    )
     
-    # STEP 3: WAIT FOR SEGMENTS
-    start_time = time.time()
-    segments_ready = False
-    min_segments = 3      # Wait for 3 segments
-    max_wait = 60         # 60 seconds max
-    last_count = 0
-    
-    print(f"[Preview] Waiting for {min_segments} segments...\n")
-    
-    time.sleep(2)
-    
-    if ffmpeg_process.poll() is not None:
-        stdout, stderr = ffmpeg_process.communicate()
-        print(f"[FFmpeg] ❌ Crashed!")
-        print(f"[FFmpeg] Error: {stderr[:1000] if stderr else 'Unknown'}\n")
-        cleanup_preview_directory(Path(preview_dir_str))
-        raise HTTPException(status_code=500, detail="FFmpeg failed")
-    
-    while time.time() - start_time < max_wait:
-        elapsed = int(time.time() - start_time)
-        
-        # Check if FFmpeg done
-        if ffmpeg_process.poll() is not None:
-            segment_files = glob.glob(os.path.join(preview_dir_str, "segment*.ts"))
-            segment_count = len(segment_files)
-            if segment_count > 0:
-                segments_ready = True
-                print(f"\n[Preview] ✅ FFmpeg done! {segment_count} segments ({elapsed}s)\n")
-                break
-            else:
-                stdout, stderr = ffmpeg_process.communicate()
-                print(f"\n[FFmpeg] ❌ No segments!")
-                print(f"[FFmpeg] Error: {stderr[:1000]}\n")
-                cleanup_preview_directory(Path(preview_dir_str))
-                raise HTTPException(status_code=500, detail="FFmpeg failed to create segments")
-        
-        if os.path.exists(playlist_path_str):
-            segment_files = glob.glob(os.path.join(preview_dir_str, "segment*.ts"))
-            segment_count = len(segment_files)
-            
-            if segment_count != last_count and segment_count > 0:
-                print(f"[Preview] ✓ {segment_count} segment(s) ({elapsed}s)")
-                last_count = segment_count
-            
-            if segment_count >= min_segments:
-                segments_ready = True
-                print(f"\n[Preview] ✅ {segment_count} segments ready! ({elapsed}s)")
-                print(f"[Preview] FFmpeg continues in background...\n")
-                break
-        else:
-            if elapsed % 5 == 0 and elapsed > 0:
-                print(f"[Preview] Processing... ({elapsed}s)")
-        
-        time.sleep(1.0)
-    
-    if not segments_ready:
-        segment_files = glob.glob(os.path.join(preview_dir_str, "segment*.ts"))
-        segment_count = len(segment_files)
-        
-        if segment_count >= 1:
-            print(f"[Preview] ⚠️ Using {segment_count} partial segment(s)\n")
-            segments_ready = True
-        else:
-            try:
-                if ffmpeg_process.poll() is None:
-                    ffmpeg_process.terminate()
-            except:
-                pass
-            cleanup_preview_directory(Path(preview_dir_str))
-            raise HTTPException(status_code=500, detail="Timeout - no segments created")
-    
-    # Count final segments
-    segment_files = glob.glob(os.path.join(preview_dir_str, "segment*.ts"))
-    segment_count = len(segment_files)
-    
-    # Store session
+    # STEP 3: REGISTER SESSION AND RETURN IMMEDIATELY
+    # Don't hold the HTTP request hostage while FFmpeg warms up - the HLS
+    # client tolerates a playlist that 404s briefly, and a background task
+    # flips the session to "ready" once segments land.
     active_sessions[preview_id] = {
-        "created_at": time.time(),
+        "started": time.monotonic(),
+        "state": "warming",
         "video_url": video_url,
+        "url_key": url_key,
         "local_video": local_video_path,
         "ffmpeg_process": ffmpeg_process,
         "preview_dir": preview_dir_str,
-        "segment_count": segment_count
+        "segment_count": 0,
+        "segments": deque(maxlen=TOTAL_ACTIVE_SEGMENTS),
+        "ready_event": asyncio.Event(),
+        "playlist_url": playlist_url,
+        "mode": "transcode" if (reencode or MULTI_RENDITION) else "copy",
+        "transcode_slot": transcode_slot,
+        "download_done": download_done,
+        "pump_task": pump_task
     }
-    
-    playlist_url = f"/hls/{preview_id}/playlist.m3u8"
-    
-    print(f"{'='*70}")
-    print(f"[Preview] ✅ PREVIEW READY!")
-    print(f"{'='*70}")
-    print(f"[Preview] Segments: {segment_count} (~{segment_count * 10}s)")
-    print(f"[Preview] Playlist: {playlist_url}")
-    print(f"{'='*70}\n")
-    
+    url_to_preview[url_key] = preview_id
+    preview_refcounts[preview_id] = 1
+
+    stop_event = asyncio.Event()
+    watch_stop_events[preview_id] = stop_event
+    spawn_task(watch_segments(preview_id, preview_dir_str, stop_event))
+    spawn_task(
+        promote_when_ready(preview_id, ffmpeg_process, preview_dir_str)
+    )
+
+    logger.info("[Preview] %s warming: playlist=%s", preview_id, playlist_url)
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "preview_id": preview_id,
+            "playlist_url": playlist_url,
+            "segment_duration": PREVIEW_SEGMENT_SECONDS,
+            "state": "warming",
+            "status_url": f"/status/{preview_id}",
+            "message": "Preview warming - poll playlist or status URL"
+        },
+        headers=segment_preload_headers(preview_id)
+    )
+
+
+@app.get("/status/{preview_id}")
+async def preview_status(preview_id: str):
+    """Report the state of a preview session (warming / ready / failed)"""
+    session = active_sessions.get(preview_id)
+
+    if session is None:
+        raise HTTPException(status_code=404, detail="Preview not found")
+
     return {
         "preview_id": preview_id,
-        "playlist_url": playlist_url,
-        "segment_duration": 10,
-        "available_segments": segment_count,
-        "message": "Preview ready"
+        "state": session["state"],
+        "mode": session["mode"],
+        "available_segments": session["segment_count"],
+        "playlist_url": session["playlist_url"]
     }
 
 
@@ -348,9 +627,18 @@ async def end_preview(request: Request):
     
     if preview_id not in active_sessions:
         raise HTTPException(status_code=404, detail="Preview not found")
-    
-    cleanup_session(preview_id)
-    
+
+    # Other viewers may still be watching the same encode
+    remaining = preview_refcounts.get(preview_id, 1) - 1
+    if remaining > 0:
+        preview_refcounts[preview_id] = remaining
+        return {
+            "status": "success",
+            "message": f"Preview {preview_id} released ({remaining} viewers remain)"
+        }
+
+    await cleanup_session(preview_id)
+
     return {
         "status": "success",
         "message": f"Preview {preview_id} ended"
@@ -377,24 +665,23 @@ async def debug_sessions():
     sessions_info = []
     
     for preview_id, session in active_sessions.items():
-        age = int(time.time() - session["created_at"])
+        age = int(time.monotonic() - session["started"])
         
         # Check FFmpeg status
         ffmpeg_running = False
         ffmpeg_process = session.get("ffmpeg_process")
-        if ffmpeg_process and ffmpeg_process.poll() is None:
+        if ffmpeg_process and ffmpeg_process.returncode is None:
             ffmpeg_running = True
         
-        # Count segments
-        preview_dir = session["preview_dir"]
-        segment_count = len(glob.glob(os.path.join(preview_dir, "segment*.ts")))
-        
         sessions_info.append({
             "preview_id": preview_id,
             "age_seconds": age,
             "video_url": session["video_url"],
-            "segments": segment_count,
-            "ffmpeg_running": ffmpeg_running
+            "state": session["state"],
+            "segments": session["segment_count"],
+            "active_window": list(session["segments"]),
+            "ffmpeg_running": ffmpeg_running,
+            "ffmpeg_log_tail": list(ffmpeg_logs.get(preview_id, []))[-5:]
         })
     
     return {
@@ -407,73 +694,953 @@ async def debug_sessions():
 # HELPER FUNCTIONS
 # ============================================================================
 
-def cleanup_session(preview_id: str):
-    """Cleanup a preview session"""
-    if preview_id not in active_sessions:
+# Invariant head shared by every preview FFmpeg invocation - built once
+# instead of re-assembled per request, and the single place to tune
+# global probe/threading behavior
+FFMPEG_BASE_ARGS = (
+    "ffmpeg",
+    "-hide_banner",
+    "-y",
+    "-threads", "0",
+    # Cap input probing: the default spends seconds sniffing the stream
+    # before the first segment can be cut; MP4/H.264 needs far less
+    "-probesize", "500K",
+    "-analyzeduration", "0",
+    "-fflags", "+nobuffer"
+)
+
+
+def build_multi_rendition_command(input_path: str, preview_dir_str: str) -> list:
+    """
+    Build one FFmpeg invocation that encodes all RENDITIONS.
+
+    The source is decoded once and branched into N scaled encodes with a
+    master playlist, instead of paying a full decode per rendition in
+    separate processes.
+    """
+    codec = HW_ENCODER or VIDEO_CODEC
+
+    cmd = [*FFMPEG_BASE_ARGS, "-i", input_path]
+
+    for _ in RENDITIONS:
+        cmd += ["-map", "0:v:0", "-map", "0:a:0"]
+
+    cmd += ["-c:v", codec]
+    if codec in HW_ENCODER_FLAGS:
+        cmd += HW_ENCODER_FLAGS[codec]
+    else:
+        cmd += ["-preset", VIDEO_PRESET, "-tune", VIDEO_TUNE]
+
+    for i, (_, scale, bitrate) in enumerate(RENDITIONS):
+        cmd += [f"-filter:v:{i}", f"scale={scale}", f"-b:v:{i}", bitrate]
+
+    cmd += [
+        "-g", str(GOP_SIZE),
+        "-keyint_min", str(GOP_SIZE),
+        "-sc_threshold", "0",
+        "-c:a", AUDIO_CODEC,
+        "-var_stream_map", " ".join(f"v:{i},a:{i}" for i in range(len(RENDITIONS))),
+        "-master_pl_name", "master.m3u8",
+        "-f", "hls",
+        "-hls_time", str(PREVIEW_SEGMENT_SECONDS),
+        "-hls_init_time", str(HLS_INIT_SECONDS),
+        "-hls_list_size", str(TOTAL_ACTIVE_SEGMENTS),
+        # temp_file: segments are written to a dotfile and renamed into
+        # place, so the watcher and clients never observe a half-written .ts
+        "-hls_flags", "delete_segments+append_list+independent_segments+temp_file",
+        "-hls_segment_filename", os.path.join(preview_dir_str, "%v", "segment%03d.ts"),
+        os.path.join(preview_dir_str, "%v", "playlist.m3u8")
+    ]
+
+    return cmd
+
+
+# Split FFmpeg stderr on both line endings: periodic stats updates are
+# terminated with \r, which line iteration would accumulate until the
+# 64 KB stream limit kills the reader
+FFMPEG_LINE_SPLIT_RE = re.compile(rb"[\r\n]")
+
+
+async def drain_ffmpeg_stderr(preview_id: str, stream: asyncio.StreamReader):
+    """
+    Continuously read FFmpeg's stderr so the pipe never fills up and blocks
+    the encoder mid-stream. The most recent lines are kept in a ring buffer
+    so /debug/sessions can show what FFmpeg was doing last. Reads fixed-size
+    chunks rather than lines - stats updates end in \r, and line iteration
+    would blow asyncio's stream limit after a few minutes of encoding.
+    """
+    ring = deque(maxlen=256)
+    ffmpeg_logs[preview_id] = ring
+    pending = b""
+
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+
+        *lines, pending = FFMPEG_LINE_SPLIT_RE.split(pending + chunk)
+        for line in lines:
+            if line:
+                ring.append(line.decode("utf-8", "replace"))
+
+        # A single "line" larger than a chunk has no delimiter to wait for
+        if len(pending) >= 65536:
+            ring.append(pending.decode("utf-8", "replace"))
+            pending = b""
+
+    if pending:
+        ring.append(pending.decode("utf-8", "replace"))
+
+
+async def pump_download(
+    preview_id: str,
+    video_url: str,
+    local_video_path: str,
+    ffmpeg_process,
+    download_done: asyncio.Event
+):
+    """
+    Stream the source video into FFmpeg's stdin while teeing it to disk.
+
+    FFmpeg demuxes from byte zero instead of waiting for a full staged
+    download, roughly halving time-to-first-segment on large files. The
+    on-disk copy is kept for metadata probing and any retry fallback;
+    download_done is set once it stops growing, so retries never read a
+    file that is still being appended to.
+    """
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+    }
+    download_start = time.monotonic()
+    downloaded = 0
+    last_log = 0
+    feeding = True
+
+    try:
+        async with http_client.stream("GET", video_url, headers=headers) as response:
+            response.raise_for_status()
+
+            total_size = int(response.headers.get('content-length', 0))
+            total_mb = total_size / (1024 * 1024)
+            if total_size > 0:
+                logger.info("[Download] File size: %.1f MB", total_mb)
+
+            async with aiofiles.open(local_video_path, 'wb') as f:
+                # Reserve the full extent up front when the size is known:
+                # the tee then does pure data writes with no per-chunk block
+                # allocation, and the file lands unfragmented so FFmpeg's
+                # later sequential reads get proper readahead
+                if total_size > 0 and hasattr(os, "posix_fallocate"):
+                    fd = f.fileno()
+                    try:
+                        await asyncio.to_thread(
+                            os.posix_fallocate, fd, 0, total_size
+                        )
+                    except OSError:
+                        # Not all filesystems support it (e.g. tmpfs/NFS)
+                        pass
+
+                # Bounded read-ahead: the network producer keeps filling
+                # the queue while the consumer is blocked on disk or on
+                # FFmpeg's stdin, so slow writes no longer stall the socket
+                chunk_queue: asyncio.Queue = asyncio.Queue(
+                    maxsize=READAHEAD_CHUNKS
+                )
+
+                async def produce():
+                    try:
+                        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                            await chunk_queue.put(chunk)
+                    finally:
+                        # Always deliver the sentinel - if the stream dies
+                        # mid-body the consumer must not wait forever; its
+                        # `await producer` then re-raises the real error
+                        await chunk_queue.put(None)
+
+                producer = asyncio.create_task(produce())
+
+                try:
+                    while True:
+                        chunk = await chunk_queue.get()
+                        if chunk is None:
+                            break
+
+                        await f.write(chunk)
+
+                        if feeding:
+                            try:
+                                ffmpeg_process.stdin.write(chunk)
+                                await ffmpeg_process.stdin.drain()
+                            except (BrokenPipeError, ConnectionResetError):
+                                # FFmpeg closed its end (finished or died);
+                                # keep the disk copy going
+                                feeding = False
+
+                        downloaded += len(chunk)
+                        downloaded_mb = downloaded / (1024 * 1024)
+
+                        # Log every 10MB
+                        if downloaded_mb - last_log >= 10:
+                            if total_size > 0:
+                                pct = (downloaded / total_size) * 100
+                                logger.debug("[Download] %.0fMB / %.0fMB (%.0f%%)",
+                                             downloaded_mb, total_mb, pct)
+                            else:
+                                logger.debug("[Download] %.0fMB downloaded...",
+                                             downloaded_mb)
+                            last_log = downloaded_mb
+
+                    # Surface any network error the producer hit
+                    await producer
+                finally:
+                    if not producer.done():
+                        producer.cancel()
+
+        if feeding:
+            try:
+                ffmpeg_process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        download_time = int(time.monotonic() - download_start)
+        logger.info("[Download] Complete: %.1fMB in %ds",
+                    downloaded / (1024 * 1024), download_time)
+
+    except Exception as e:
+        logger.error("[Download] %s failed: %s", preview_id, e)
+
+        if preview_id in active_sessions:
+            await fail_session(preview_id)
+        else:
+            await terminate_ffmpeg(ffmpeg_process)
+    finally:
+        # Wakes any retry waiting on the local copy (failure included -
+        # the waiter re-checks the session state before using the file)
+        download_done.set()
+
+
+# Probe results by source URL. A video behind a URL effectively never
+# changes codecs, so entries stay until LRU-evicted; each hit skips a
+# few hundred ms of ffprobe subprocess spawn.
+probe_cache: "OrderedDict[str, tuple]" = OrderedDict()
+PROBE_CACHE_MAX = 256
+
+
+async def probe_codecs(source: str):
+    """
+    Ask ffprobe for the source's video/audio codec names.
+
+    Stream copy into HLS only works when the source is already H.264 with
+    an AAC/MP3-family audio track; anything else needs a re-encode.
+    Results are cached per source URL. Returns (video_codec, audio_codec);
+    both None when probing failed.
+    """
+    cached = probe_cache.get(source)
+    if cached is not None:
+        probe_cache.move_to_end(source)
+        return cached
+
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffprobe",
+            "-v", "quiet",
+            "-print_format", "json",
+            "-show_streams",
+            source,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=10)
+        streams = json.loads(stdout).get("streams", [])
+    except Exception:
+        # wait_for only cancels the read - an ffprobe wedged on an
+        # unresponsive URL must be reaped or it lives forever
+        if proc is not None and proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+        return None, None
+
+    video = next(
+        (s.get("codec_name") for s in streams if s.get("codec_type") == "video"),
+        None
+    )
+    audio = next(
+        (s.get("codec_name") for s in streams if s.get("codec_type") == "audio"),
+        None
+    )
+
+    probe_cache[source] = (video, audio)
+    if len(probe_cache) > PROBE_CACHE_MAX:
+        probe_cache.popitem(last=False)
+
+    return video, audio
+
+
+def ffmpeg_preexec():
+    """
+    Runs in the child between fork and exec (Linux/macOS only).
+
+    Puts FFmpeg in its own process group so shutdown can signal the whole
+    tree (FFmpeg forks helpers for some protocols), deprioritizes it and,
+    where supported, keeps it off CPU 0 so encode bursts contend less with
+    the event loop serving /hls and API requests.
+    """
+    os.setsid()
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+    if hasattr(os, "sched_setaffinity"):
+        cores = set(range(1, os.cpu_count() or 1))
+        if cores:
+            try:
+                os.sched_setaffinity(0, cores)
+            except OSError:
+                pass
+
+
+async def probe_video_url(video_url: str) -> int:
+    """
+    Quick reachability probe before any session slot or FFmpeg process is
+    committed - a dead host should fail in 2 s, not after FFMPEG_TIMEOUT.
+    Probes with a one-byte ranged GET rather than HEAD: presigned S3/GCS
+    URLs sign the method and answer HEAD with 403 even though the GET the
+    download will actually issue works fine.
+    Returns the advertised content length (0 if unknown).
+    """
+    headers = {"Range": "bytes=0-0"}
+    async with http_client.stream(
+        "GET", video_url, headers=headers, timeout=2.0
+    ) as response:
+        response.raise_for_status()
+
+        # A 206 advertises the full size in Content-Range ("bytes 0-0/N");
+        # servers that ignore Range answer 200 with a plain Content-Length
+        content_range = response.headers.get("content-range", "")
+        total = content_range.rpartition("/")[2]
+        if total.isdigit():
+            return int(total)
+        return int(response.headers.get("content-length", 0))
+
+
+def build_ffmpeg_command(
+    input_path: str,
+    playlist_path: str,
+    segment_pattern: str,
+    reencode: bool = False,
+    video_codec: Optional[str] = None
+) -> list:
+    """
+    Build the FFmpeg HLS conversion command.
+
+    Default is stream copy (no re-encoding - fastest). The re-encode variant
+    uses all cores (-threads 0) and keyframes aligned to segment boundaries
+    (GOP_SIZE) so segments never contain partial GOPs. video_codec forces a
+    specific encoder, overriding the detected hardware one.
+    """
+    cmd = list(FFMPEG_BASE_ARGS)
+
+    # Let FFmpeg pick a hardware decoder too when we must re-encode, so the
+    # decode side doesn't bottleneck a GPU-accelerated encode
+    if reencode and video_codec is None and HW_ENCODER is not None:
+        cmd += ["-hwaccel", "auto"]
+
+    cmd += ["-i", input_path]
+
+    if reencode:
+        codec = video_codec or HW_ENCODER or VIDEO_CODEC
+        cmd += ["-c:v", codec]
+
+        if codec in HW_ENCODER_FLAGS:
+            cmd += HW_ENCODER_FLAGS[codec]
+        else:
+            cmd += ["-preset", VIDEO_PRESET, "-tune", VIDEO_TUNE]
+
+        cmd += [
+            "-g", str(GOP_SIZE),
+            "-keyint_min", str(GOP_SIZE),
+            "-sc_threshold", "0",
+            "-c:a", AUDIO_CODEC
+        ]
+    else:
+        cmd += ["-c", "copy"]
+
+    # Bound the playlist to the sliding window the app actually exposes
+    # (backward + current + forward buffer); FFmpeg reaps older segments
+    # itself, keeping disk usage and playlist-parse cost constant.
+    cmd += [
+        "-f", "hls",
+        "-hls_time", str(PREVIEW_SEGMENT_SECONDS),
+        "-hls_init_time", str(HLS_INIT_SECONDS),
+        "-hls_list_size", str(TOTAL_ACTIVE_SEGMENTS),
+        # temp_file: segments are written to a dotfile and renamed into
+        # place, so the watcher and clients never observe a half-written .ts
+        "-hls_flags", "delete_segments+append_list+independent_segments+temp_file",
+        "-hls_segment_filename", segment_pattern,
+        "-start_number", "0",
+        playlist_path
+    ]
+
+    return cmd
+
+
+def ts_segment_names(preview_dir_str: str) -> list:
+    """
+    List segment file names in a preview directory via os.scandir.
+
+    Cheaper than Path.glob, which wraps every entry in a Path object and
+    runs fnmatch; scandir iterates raw dirents with simple string checks.
+    """
+    try:
+        with os.scandir(preview_dir_str) as entries:
+            return sorted(
+                entry.name for entry in entries
+                if entry.name.startswith("segment") and entry.name.endswith(".ts")
+            )
+    except FileNotFoundError:
+        return []
+
+
+def prefault_segment(path: str):
+    """
+    Ask the kernel to read a fresh segment into the page cache.
+
+    Only matters when HLS_DIR fell back to disk (tmpfs pages are already
+    resident) - the first player GET then hits warm pages instead of
+    paying the read at request time.
+    """
+    if not hasattr(os, "posix_fadvise"):
         return
-    
-    print(f"[Cleanup] Cleaning up: {preview_id}")
-    
-    session = active_sessions[preview_id]
-    
-    # Stop FFmpeg if still running
-    ffmpeg_process = session.get("ffmpeg_process")
-    if ffmpeg_process:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+async def watch_segments(
+    preview_id: str,
+    preview_dir_str: str,
+    stop_event: asyncio.Event
+):
+    """
+    Per-session watcher keeping the session's segment ring buffer in sync
+    with the preview directory.
+
+    One filesystem event per segment replaces a glob per poll: the deque
+    holds the names currently in the sliding window, the cached count feeds
+    /status and /debug/sessions, and ready_event wakes the warming task the
+    moment enough segments exist. Runs until the session is cleaned up.
+    """
+    session = active_sessions.get(preview_id)
+    if session is None:
+        return
+
+    segments: deque = session["segments"]
+    produced = 0
+
+    # Pick up anything written before the watcher started
+    for name in ts_segment_names(preview_dir_str):
+        segments.append(name)
+        produced += 1
+
+    session["segment_count"] = produced
+    if produced >= MIN_SEGMENTS_TO_START:
+        session["ready_event"].set()
+
+    async for changes in awatch(preview_dir_str, stop_event=stop_event):
+        for change, path in changes:
+            name = os.path.basename(path)
+            if not name.endswith(".ts"):
+                continue
+
+            if change == Change.added:
+                if name not in segments:
+                    segments.append(name)
+                    produced += 1
+                    prefault_segment(path)
+            elif change == Change.deleted:
+                try:
+                    segments.remove(name)
+                except ValueError:
+                    pass
+
+        session["segment_count"] = produced
+        if produced >= MIN_SEGMENTS_TO_START:
+            session["ready_event"].set()
+
+
+async def promote_when_ready(
+    preview_id: str,
+    ffmpeg_process,
+    preview_dir_str: str
+):
+    """
+    Background task: flip a warming session to "ready" once enough
+    segments exist, or to "failed" if FFmpeg dies without producing any.
+    """
+    while True:
+        session = active_sessions.get(preview_id)
+        if session is None:
+            return
+
+        ready = asyncio.create_task(session["ready_event"].wait())
+        exited = asyncio.create_task(ffmpeg_process.wait())
+
+        done, pending = await asyncio.wait(
+            {ready, exited},
+            timeout=FFMPEG_TIMEOUT,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+
+        session = active_sessions.get(preview_id)
+        if session is None or session.get("resources_released"):
+            # Preview was ended or already torn down while warming
+            return
+
+        segment_count = session["segment_count"]
+
+        # The watcher delivers events in batches tens of ms after the
+        # write, so a fast encode can exit before its segments are
+        # counted; recount from the directory before judging the attempt
+        # failed, or a successful preview gets killed and retried
+        if segment_count < MIN_SEGMENTS_TO_START:
+            segment_count = len(ts_segment_names(preview_dir_str))
+
+        if segment_count >= MIN_SEGMENTS_TO_START:
+            session["state"] = "ready"
+            logger.info("[Preview] %s ready (%d segments)",
+                        preview_id, segment_count)
+            return
+
+        # A failed attempt walks the retry ladder (file copy, then
+        # re-encode) before the session is declared dead
+        ffmpeg_process = await retry_with_reencode(
+            preview_id, session, preview_dir_str
+        )
+        if ffmpeg_process is not None:
+            continue
+
+        logger.error("[Preview] %s failed - no segments produced", preview_id)
+        await fail_session(preview_id)
+        return
+
+
+async def terminate_ffmpeg(process):
+    """
+    Stop an FFmpeg process tree: SIGTERM its process group, wait up to 5s,
+    then SIGKILL the group. Falls back to plain terminate/kill when the
+    group is already gone or group signalling is unavailable.
+    """
+    if process.returncode is not None:
+        return
+
+    def signal_group(sig) -> bool:
+        try:
+            os.killpg(os.getpgid(process.pid), sig)
+            return True
+        except (AttributeError, OSError, ProcessLookupError):
+            return False
+
+    if not signal_group(signal.SIGTERM):
         try:
-            if ffmpeg_process.poll() is None:
-                print(f"[Cleanup] Stopping FFmpeg...")
-                ffmpeg_process.terminate()
-                ffmpeg_process.wait(timeout=5)
-        except:
+            process.terminate()
+        except ProcessLookupError:
+            return
+
+    try:
+        await asyncio.wait_for(process.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        if not signal_group(signal.SIGKILL):
             try:
-                ffmpeg_process.kill()
-            except:
+                process.kill()
+            except ProcessLookupError:
                 pass
+        await process.wait()
+
+
+async def retry_with_reencode(preview_id: str, session: dict, preview_dir_str: str):
+    """
+    Walk the retry ladder after a failed attempt: pipe-fed copy, then
+    copy from the teed local file, then re-encode.
+
+    The dominant pipe-copy failure is a non-faststart MP4 - the moov atom
+    sits at the tail, unreachable on unseekable stdin - and those bytes
+    remux fine from the seekable local file, so the cheap copy gets a
+    second chance before anything is re-encoded. A failed hardware
+    re-encode additionally gets one attempt on software - the startup
+    test can pass and the driver still fall over on real input. Returns
+    the new FFmpeg process, or None when no further retry is possible.
+    """
+    mode = session.get("mode")
+    if mode == "copy":
+        next_mode, reencode, video_codec = "file-copy", False, None
+    elif mode == "file-copy":
+        next_mode, reencode, video_codec = "transcode", True, None
+    elif (
+        mode == "transcode"
+        and HW_ENCODER
+        and not session.get("software_fallback")
+    ):
+        session["software_fallback"] = True
+        next_mode, reencode, video_codec = "transcode", True, VIDEO_CODEC
+    else:
+        return None
+
+    local_video = session.get("local_video")
+    if not local_video:
+        return None
+
+    # Every rung reads the local copy, which is only whole once the pump
+    # stops appending - launching against a mid-download file would hit
+    # EOF early and serve a silently truncated preview
+    download_done = session.get("download_done")
+    if download_done is not None:
+        try:
+            await asyncio.wait_for(
+                download_done.wait(), timeout=SESSION_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            return None
+    if session.get("resources_released") or preview_id not in active_sessions:
+        return None
+
+    try:
+        if os.path.getsize(local_video) == 0:
+            return None
+    except OSError:
+        return None
+
+    # An encode rung must take a transcode slot like any other (unless the
+    # session already holds one); give up on the retry rather than
+    # oversubscribe the CPU
+    if reencode and not session.get("transcode_slot"):
+        try:
+            await asyncio.wait_for(
+                transcode_semaphore.acquire(), timeout=ADMISSION_WAIT_SECONDS
+            )
+            session["transcode_slot"] = True
+        except asyncio.TimeoutError:
+            return None
+
+    old_process = session.get("ffmpeg_process")
+    if old_process:
+        await terminate_ffmpeg(old_process)
+
+    playlist_path = os.path.join(preview_dir_str, "playlist.m3u8")
+    segment_pattern = os.path.join(preview_dir_str, "segment%03d.ts")
+    cmd = build_ffmpeg_command(
+        local_video, playlist_path, segment_pattern,
+        reencode=reencode, video_codec=video_codec
+    )
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=str(HLS_DIR),
+            preexec_fn=ffmpeg_preexec if os.name == "posix" else None
+        )
+    except Exception:
+        return None
+
+    session["ffmpeg_process"] = process
+    session["mode"] = next_mode
+    spawn_task(drain_ffmpeg_stderr(preview_id, process.stderr))
+
+    if video_codec:
+        logger.warning("[Preview] %s hardware re-encode failed - retrying on %s",
+                       preview_id, video_codec)
+    elif next_mode == "file-copy":
+        logger.warning("[Preview] %s piped copy failed - retrying copy from "
+                       "local file", preview_id)
+    else:
+        logger.warning("[Preview] %s stream copy failed - retrying as re-encode",
+                       preview_id)
+    return process
+
+
+# How often the session reaper wakes up (seconds)
+REAPER_INTERVAL = 60
+
+
+async def reaper_loop():
+    """
+    Periodically prune sessions that outlived SESSION_TIMEOUT.
+
+    Without this, abandoned previews (client never calls /end-preview)
+    accumulate FFmpeg processes and segment directories forever.
+    """
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL)
+
+        now = time.monotonic()
+        expired = [
+            preview_id
+            for preview_id, session in active_sessions.items()
+            if now - session["started"] > SESSION_TIMEOUT
+        ]
+
+        for preview_id in expired:
+            logger.info("[Reaper] Session expired: %s", preview_id)
+            await cleanup_session(preview_id)
+
+
+async def prewarm_ffmpeg():
+    """
+    Run one throwaway FFmpeg encode at startup.
+
+    Process creation plus codec/muxer init costs tens of ms per session; a
+    warm-up run keeps the binary, shared libraries and codec tables in the
+    page cache so the first real preview doesn't pay the cold start. (A pool
+    of persistent stdin-fed workers would amortize more, but each session
+    owns its HLS output directory, which FFmpeg can't retarget after spawn.)
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel", "error",
+            "-f", "lavfi",
+            "-i", "testsrc=duration=0.1:size=128x72:rate=10",
+            "-f", "null", "-",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        await proc.wait()
+    except Exception:
+        pass
+
+
+async def validate_hw_encoder(encoder: str) -> bool:
+    """
+    Prove an encoder actually works by encoding a few test frames.
+
+    `ffmpeg -encoders` only shows what was compiled in - distro builds
+    list nvenc/qsv on machines with no GPU at all, and that failure would
+    otherwise surface only when a real session needs a re-encode.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel", "error",
+            "-f", "lavfi",
+            "-i", "testsrc=duration=0.1:size=128x72:rate=10",
+            "-c:v", encoder,
+            *HW_ENCODER_FLAGS[encoder],
+            "-f", "null", "-",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except Exception:
+        return False
+
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=15)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return False
+
+    return proc.returncode == 0
+
+
+async def detect_hw_encoder() -> Optional[str]:
+    """
+    Detect a working hardware H.264 encoder.
+
+    Run once at startup - hardware encoders offload encoding to a dedicated
+    codec engine, which is far faster than libx264 and frees the CPU for the
+    server itself. Each candidate from the encoder listing is confirmed
+    with a test encode before being trusted for real sessions.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-encoders",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=10)
+    except Exception:
+        return None
+
+    listed = stdout.decode("utf-8", "replace")
+    for encoder in HW_ENCODER_FLAGS:
+        if encoder in listed and await validate_hw_encoder(encoder):
+            return encoder
+
+    return None
+
+
+async def fail_session(preview_id: str):
+    """
+    Tear down a failed session's resources while keeping a tombstone.
+
+    Releases the session and transcode slots, stops the watcher, reaps
+    FFmpeg, drops the URL mapping and removes the directory immediately -
+    a failed re-encode must not pin a transcode slot until the reaper
+    fires. The entry itself stays in active_sessions with state="failed"
+    so /status keeps answering until /end-preview or the reaper drops it.
+    """
+    session = active_sessions.get(preview_id)
+    if session is None or session.get("resources_released"):
+        return
+
+    session["resources_released"] = True
+    session["state"] = "failed"
+
+    # Stop the download first: once the directory is gone the tee writes
+    # into an unlinked tmpfs file, pinning RAM for the rest of the
+    # transfer. The pump may itself be the caller (download error path) -
+    # it then just returns, so never cancel the current task.
+    pump_task = session.get("pump_task")
+    if pump_task and pump_task is not asyncio.current_task():
+        pump_task.cancel()
+
+    stop_event = watch_stop_events.pop(preview_id, None)
+    if stop_event:
+        stop_event.set()
+
+    ffmpeg_process = session.get("ffmpeg_process")
+    if ffmpeg_process:
+        await terminate_ffmpeg(ffmpeg_process)
+
+    # A dead preview must not capture new viewers of the same URL
+    url_key = session.get("url_key")
+    if url_key and url_to_preview.get(url_key) == preview_id:
+        del url_to_preview[url_key]
+
+    session_semaphore.release()
+    if session.get("transcode_slot"):
+        transcode_semaphore.release()
+        session["transcode_slot"] = False
+
+    await asyncio.to_thread(
+        cleanup_preview_directory, Path(session["preview_dir"])
+    )
+
+
+async def cleanup_session(preview_id: str):
+    """
+    Cleanup a preview session.
+
+    Pops the session atomically up front so concurrent callers (the reaper
+    and /end-preview can race on the same id) see it gone after the first
+    await point - without this, both would run teardown and the semaphore
+    slot would be released twice.
+    """
+    session = active_sessions.pop(preview_id, None)
+    if session is None:
+        return
+
+    logger.info("[Cleanup] Cleaning up: %s", preview_id)
+
+    # Stop the download - an abandoned pump would keep fetching the whole
+    # source into an unlinked file after the directory is removed below
+    pump_task = session.get("pump_task")
+    if pump_task and pump_task is not asyncio.current_task():
+        pump_task.cancel()
+
+    # Stop the session's segment watcher
+    stop_event = watch_stop_events.pop(preview_id, None)
+    if stop_event:
+        stop_event.set()
     
-    # Delete directory
+    # Stop FFmpeg (and any helpers in its process group) if still running
+    ffmpeg_process = session.get("ffmpeg_process")
+    if ffmpeg_process:
+        logger.debug("[Cleanup] Stopping FFmpeg...")
+        await terminate_ffmpeg(ffmpeg_process)
+    
+    # Delete directory off the event loop thread
     preview_dir = Path(session["preview_dir"])
-    cleanup_preview_directory(preview_dir)
+    await asyncio.to_thread(cleanup_preview_directory, preview_dir)
     
-    # Remove from sessions
-    del active_sessions[preview_id]
+    # Drop caches tied to this preview
+    playlist_cache.pop(preview_id, None)
+    ffmpeg_logs.pop(preview_id, None)
+    preview_refcounts.pop(preview_id, None)
+
+    url_key = session.get("url_key")
+    if url_key and url_to_preview.get(url_key) == preview_id:
+        del url_to_preview[url_key]
+
+    # Free the session slot (and the transcode slot if one was held),
+    # unless fail_session already returned them with the tombstone
+    if not session.get("resources_released"):
+        session_semaphore.release()
+        if session.get("transcode_slot"):
+            transcode_semaphore.release()
     
-    print(f"[Cleanup] Done\n")
+    logger.debug("[Cleanup] Done")
 
 
 def cleanup_preview_directory(preview_dir: Path):
-    """Delete preview directory"""
-    if not preview_dir.exists():
-        return
-    
-    try:
-        file_count = 0
-        for file in preview_dir.glob("*"):
-            try:
-                file.unlink()
-                file_count += 1
-            except:
-                pass
-        
-        try:
-            preview_dir.rmdir()
-            if file_count > 0:
-                print(f"[Cleanup] Deleted {file_count} files")
-        except:
-            pass
-            
-    except Exception as e:
-        print(f"[Cleanup] Error: {e}")
+    """Delete preview directory (one rmtree instead of per-file unlinks)"""
+    shutil.rmtree(preview_dir, ignore_errors=True)
 
 
 # ============================================================================
 # STARTUP & SHUTDOWN
 # ============================================================================
 
-@app.on_event("startup")
-async def startup_event():
-    """Server startup"""
+async def server_startup():
+    """Server startup (run from the lifespan context)"""
+    global HW_ENCODER, http_client
+
     print("\n")
+    validate_config()
     print_config()
+    setup_logging()
+
+    # HTTP/2 multiplexes probe + download round-trips on one connection for
+    # origins that support it; transport-level retries absorb transient
+    # connect failures without surfacing them as failed previews
+    http_client = httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=httpx.Timeout(60.0, connect=30.0),
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    )
+
+    HW_ENCODER = await detect_hw_encoder()
+    if HW_ENCODER:
+        print(f"🎞️  Hardware encoder detected: {HW_ENCODER}")
+    else:
+        print(f"🎞️  No hardware encoder - re-encode path uses {VIDEO_CODEC}")
+
+    # Preload the frontend page so / never touches the filesystem
+    index_path = FRONTEND_DIR / "index.html"
+    if index_path.exists():
+        data = index_path.read_bytes()
+        app.state.index_bytes = data
+        app.state.index_etag = hashlib.blake2b(data, digest_size=8).hexdigest()
+    else:
+        app.state.index_bytes = None
+
+    # Warm FFmpeg so the first preview skips the cold start
+    spawn_task(prewarm_ffmpeg())
+
+    # Start the background session reaper
+    app.state.reaper = asyncio.create_task(reaper_loop())
+
     print("🚀 Server started!")
     print(f"📱 Open: http://{SERVER_HOST}:{SERVER_PORT}")
     print(f"\n💡 Test URLs:")
@@ -485,15 +1652,33 @@ async def startup_event():
     print(f"   Works with any video format\n")
 
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Server shutdown"""
+async def server_shutdown():
+    """Server shutdown (run from the lifespan context)"""
     print("\n[Shutdown] Cleaning up...")
+
+    reaper = getattr(app.state, "reaper", None)
+    if reaper:
+        reaper.cancel()
     
-    session_ids = list(active_sessions.keys())
-    for preview_id in session_ids:
-        cleanup_session(preview_id)
-    
+    # Tear sessions down concurrently - each waits up to 5s for its FFmpeg
+    # to exit, and serializing that across N sessions would take 5N seconds
+    await asyncio.gather(
+        *[cleanup_session(pid) for pid in list(active_sessions)],
+        return_exceptions=True
+    )
+
+    # Cancel whatever session tasks survived cleanup (watchers waiting on
+    # their stop events, stderr drains on live pipes, ...)
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+    if http_client:
+        await http_client.aclose()
+
+    if log_listener:
+        log_listener.stop()
+
     print("[Shutdown] Done\n")
 
 
@@ -502,9 +1687,16 @@ async def shutdown_event():
 # ============================================================================
 
 if __name__ == "__main__":
+    # uvloop's C event loop and httptools' C HTTP parser handle the playlist
+    # poll + segment fetch traffic far better than the default asyncio stack.
+    # Kept at one worker: sessions hold live FFmpeg process handles, which
+    # cannot be shared across forked workers.
     uvicorn.run(
-        app,
+        "main:app",
         host=SERVER_HOST,
         port=SERVER_PORT,
+        # uvloop doesn't ship on Windows; let uvicorn fall back there
+        loop="uvloop" if sys.platform != "win32" else "auto",
+        http="httptools",
         log_level="info"
     )
\ No newline at end of file